@@ -9,81 +9,76 @@ email: Mario.Peralta@ucr.ac.cr
 The Electric Power and Energy Research Laboratory (EPERLab).
 
 """
+import os
+from concurrent.futures import ThreadPoolExecutor
 import reslac
+import numpy as np
 import pandas as pd
 
+try:
+    import xlsxwriter  # noqa: F401
+    WRITER_ENGINE = "xlsxwriter"
+except ImportError:
+    WRITER_ENGINE = "openpyxl"
+
+# Template sheets populated by fill_structure
+POPULATED_SHEETS = ("TECHNOLOGY", "FUEL", "REGION", "AccumulatedAnnualDemand")
+
+# Technology code and labeled fuels per kind of technology
+_TECH_FUELS = {
+    reslac.Primary_Tech: lambda T: (T.code, T.out_fuels),
+    reslac.Convertion_Tech: lambda T: (T.code, T.out_fuels + T.in_fuels),
+    reslac.Demand_Tech: lambda T: (f"DEM{T.code}", T.in_fuels)
+}
+
 
 class Input_Data():
+    __slots__ = ("res",)
 
     def __init__(self):
-        ose_input = {}
+        self.res = None     # Built RES
 
     def call_reslac(self) -> reslac.EnergyMatrix:
-        matrix = reslac.EnergyMatrix()
-        _ = matrix.build_RES()
-        self.res = matrix
-        return matrix
+        """Build the RES once and reuse it afterwards."""
+        if self.res is None:
+            matrix = reslac.EnergyMatrix()
+            _ = matrix.build_RES()
+            self.res = matrix
+        return self.res
 
     def call_template(
             self,
-            file_path: str = "./template/template.xlsx"
+            file_path: str = "./template/template.xlsx",
+            cache_dir: str = "./.cache",
+            engine: str = reslac.EXCEL_ENGINE,
+            sheets: tuple[str] = None
     ) -> dict[pd.DataFrame]:
-        ose_data = pd.read_excel(
+        """Read OSeMOSYS template.
+
+        Parsed sheets are cached in ``cache_dir`` by
+        :py:func:`reslac.read_workbook`, ``None`` disables it.
+        A selective read of ``sheets`` and a full read are kept
+        in separate cache files, so switching between them
+        never re-parses the template.
+
+        The Rust based ``calamine`` engine is used whenever
+        ``python-calamine`` is installed, ``openpyxl`` otherwise.
+
+        Only ``sheets`` are parsed if given (e.g.
+        :py:data:`POPULATED_SHEETS`), otherwise the whole template
+        which is required to write the complete OSeMOSYS input file.
+
+        """
+        if sheets is not None:
+            sheets = list(sheets)
+        ose_data = reslac.read_workbook(
             file_path,
-            sheet_name=None
+            cache_dir=cache_dir,
+            sheet_name=sheets,
+            engine=engine
         )
         return ose_data
 
-    def __label_prim_tech(
-            self,
-            prim_tech: reslac.Primary_Tech
-    ) -> set:
-        """Unpack & concat codes of primary technology."""
-        Tlabels_prim = set()
-        region = prim_tech.region
-        Tcode = prim_tech.code
-        for f in prim_tech.out_fuels:
-            outFcode = f.code
-            Tlabel = f"{region}&{Tcode}&{outFcode}"
-            Tlabels_prim.add(Tlabel)
-
-        return Tlabels_prim
-
-    def __label_conv_tech(
-            self,
-            conv_tech: reslac.Convertion_Tech
-    ) -> set:
-        """Unpack & concat codes of convertion technology."""
-        Tlabels_conv = set()
-        region = conv_tech.region
-        Tcode = conv_tech.code
-        for f in conv_tech.out_fuels:
-            outFcode = f.code
-            Tlabel = f"{region}&{Tcode}&{outFcode}"
-            Tlabels_conv.add(Tlabel)
-        for f in conv_tech.in_fuels:
-            inFcode = f.code
-            Tlabel = f"{region}&{Tcode}&{inFcode}"
-            Tlabels_conv.add(Tlabel)
-
-        return Tlabels_conv
-
-    def __label_dem_tech(
-            self,
-            dem_tech: reslac.Demand_Tech
-    ) -> set:
-        """Unpack & concat codes of demand technology."""
-        Tlabels_dem = set()
-        region = dem_tech.region
-        Tcode = dem_tech.code
-        for f in dem_tech.in_fuels:
-            inFcode = f.code
-            # Add "DEM" code
-            Tlabel = f"{region}&DEM{Tcode}&{inFcode}"
-            Tlabels_dem.add(Tlabel)
-
-        return Tlabels_dem
-
     def get_tech_fuel_fields(
             self, techs: list[reslac.Technology]
     ) -> list[str]:
@@ -102,75 +97,38 @@ class Input_Data():
             - FUE: Fuel
 
         According to OSeMOSYS three letters naming convention.
+        Demand technologies get the ``DEM`` code in front of ``TEC``.
+
+        Codes are flattened into columns in a single pass over
+        ``techs`` so that labels are concatenated at once.
         """
-        Tlabels_prim = set()
-        Tlabels_conv = set()
-        Tlabels_dem = set()
+        regions = []
+        Tcodes = []
+        Fcodes = []
         for T in techs:
-            if isinstance(T, reslac.Primary_Tech):
-                prim_techs = self.__label_prim_tech(prim_tech=T)
-                Tlabels_prim = Tlabels_prim.union(prim_techs)
-            elif isinstance(T, reslac.Convertion_Tech):
-                conv_techs = self.__label_conv_tech(conv_tech=T)
-                Tlabels_conv = Tlabels_conv.union(conv_techs)
-            elif isinstance(T, reslac.Demand_Tech):
-                dem_techs = self.__label_dem_tech(dem_tech=T)
-                Tlabels_dem = Tlabels_dem.union(dem_techs)
-
-        # To list
-        Tlabels_prim = list(Tlabels_prim)
-        Tlabels_conv = list(Tlabels_conv)
-        Tlabels_dem = list(Tlabels_dem)
-        # Sort techs:
-        Tlabels = Tlabels_prim + Tlabels_conv + Tlabels_dem
+            tech_fuels = _TECH_FUELS.get(type(T))
+            if not tech_fuels:
+                continue
+            Tcode, fuels = tech_fuels(T)
+            regions += [T.region] * len(fuels)
+            Tcodes += [Tcode] * len(fuels)
+            Fcodes += [f.code for f in fuels]
+
+        # Vectorized concat
+        Tlabels = pd.Series(regions, dtype=object).str.cat(
+            [pd.Series(Tcodes, dtype=object),
+             pd.Series(Fcodes, dtype=object)],
+            sep="&"
+        )
+        # Sort unique labels
+        Tlabels = sorted(Tlabels.unique())
         return Tlabels
 
-    def __set_region(self, set_fields: list) -> list:
-        """Define SET: REGION.
-
-        Split and label as: <REG>.
-        """
-        regions = list({r.split("&")[0] for r in set_fields})
-        regions.sort()
-        return regions
-
-    def __set_fuel(self, set_fields: list) -> list:
-        """Define SET: FUEL.
-
-        Split and label as: <REG><FUE>.
-        """
-        fuels = set()
-        for fiels in set_fields:
-            r_code, _, f_code = fiels.split("&")
-            fuel_label = f"{r_code}{f_code}"
-            fuels.add(fuel_label)
-
-        fuels = list(fuels)
-        fuels.sort()
-        return fuels
-
-    def __set_technology(self, set_fields: list) -> list:
-        """Define SET: TECHNOLOGY.
-
-        Split and label as: <REG><TEC><FUE>.
-        """
-        techs = set()
-        for fiels in set_fields:
-            r_code, t_code, f_code = fiels.split("&")
-            tech_label = f"{r_code}{t_code}{f_code}"
-            techs.add(tech_label)
-
-        techs = list(techs)
-        techs.sort()
-        return techs
-
     def set_sets(
             self,
             res: reslac.EnergyMatrix,
     ) -> tuple[list]:
-        """Call private methods of each SET.
-
-        Define SETS (indices) of the model.
+        """Define SETS (indices) of the model.
 
         sets = [
             "YEAR",
@@ -185,12 +143,28 @@ class Input_Data():
             "DAILYTIMEBRACKET",
             "STORAGE"
         ].
+
+        Each label is split once to fill the sets labeled as:
+
+            - REGION: <REG>
+            - TECHNOLOGY: <REG><TEC><FUE>
+            - FUEL: <REG><FUE>
         """
         techs = res._techs
         set_fields = self.get_tech_fuel_fields(techs)
-        region_col = self.__set_region(set_fields=set_fields)
-        tech_col = self.__set_technology(set_fields=set_fields)
-        fuel_col = self.__set_fuel(set_fields=set_fields)
+        regions = set()
+        Tfields = set()
+        Ffields = set()
+        for field in set_fields:
+            r_code, t_code, f_code = field.split("&")
+            regions.add(r_code)
+            Tfields.add((r_code, t_code, f_code))
+            Ffields.add((r_code, f_code))
+
+        # Sort by codes then concat
+        region_col = sorted(regions)
+        tech_col = ["".join(T) for T in sorted(Tfields)]
+        fuel_col = ["".join(F) for F in sorted(Ffields)]
         return (region_col, tech_col, fuel_col)
 
     def dem_tech_energy(
@@ -199,67 +173,48 @@ class Input_Data():
     ) -> list[tuple]:
         """Get energy of demanded fuel.
 
-        Similar to :py:meth:`oseinput.__label_dem_tech`.
+        Similar to :py:meth:`oseinput.get_tech_fuel_fields`.
         Income energy amount of technology the demands fuel.
         """
         dem_fields = []
         region = dem_tech.region
-        Tcode = dem_tech.code
+        prefix = f"DEM{dem_tech.code}"
         for f in dem_tech.in_fuels:
-            inFcode = f.code
-            Tlabel = f"{region}&DEM{Tcode}{inFcode}"
-            dem_fields.append((Tlabel, f.energy_PJ))
+            Tlabel = prefix + f.code
+            dem_fields.append((region, Tlabel, f.energy_PJ))
 
         return dem_fields
 
-    def split_label_energy_fields(
-            self,
-            label_parameters: list
-    ) -> tuple[list]:
-        """Unpack columns: REGION & LABEL & ENERGY."""
-        regions = []
-        dem_tech_labels = []
-        energies = []
-        for label, energy in label_parameters:
-            region, dem_label = label.split("&")
-            regions.append(region)
-            dem_tech_labels.append(dem_label)
-            energies.append(energy)
-
-        return regions, dem_tech_labels, energies
-
     def __accumulated_annual_demand(
             self,
             res: reslac.EnergyMatrix
-    ) -> dict:
+    ) -> pd.DataFrame:
         """Define parameter: AccumulatedAnnualDemand.
 
-        Fields (keys): Region, Label, Energy_PJ.
+        Fields (columns): Region, Label, Energy_PJ.
+        Demand is stored as negative input in the RES so
+        its absolute value is taken.
         """
         techs = res._techs
-        # Filter demand technology
-        dem_techs = [T for T in techs
-                     if isinstance(T, reslac.Demand_Tech)]
-        regions = list({D.region for D in dem_techs})
-        regions.sort()
+        # Filter demand technology sorted by region
+        dem_techs = sorted(
+            (T for T in techs if isinstance(T, reslac.Demand_Tech)),
+            key=lambda D: (D.region, D.code)
+        )
         dem_tech_code = []
-        for r in regions:
-            dem_techs_r = [D for D in dem_techs if D.region == r]
-            for D in dem_techs_r:
-                dem_tech_code += self.dem_tech_energy(
-                    dem_tech=D
-                )
-
-        demand_codes = {}
-        cols = self.split_label_energy_fields(dem_tech_code)
-        demand_codes["Region"] = cols[0]
-        demand_codes["Label"] = cols[1]
-        demand_codes["Energy_PJ"] = cols[2]
+        for D in dem_techs:
+            dem_tech_code.extend(self.dem_tech_energy(dem_tech=D))
+
+        demand_codes = pd.DataFrame(dem_tech_code,
+                                    columns=["Region", "Label", "Energy_PJ"])
+        demand_codes["Energy_PJ"] = np.abs(
+            demand_codes["Energy_PJ"].to_numpy(dtype=np.float64)
+        )
         return demand_codes
 
     def set_parameters(
             self, res: reslac.EnergyMatrix
-    ) -> tuple[dict]:
+    ) -> tuple[pd.DataFrame]:
         """Call private methods of each parameter.
 
         Note: Names longer than **31** characters require a
@@ -348,15 +303,25 @@ class Input_Data():
         accumulated_annual_demand = self.__accumulated_annual_demand(res=res)
         return (accumulated_annual_demand, )
 
-    def write_excel_oseinput(self, data: dict) -> None:
+    def write_excel_oseinput(
+            self,
+            data: dict,
+            engine: str = WRITER_ENGINE
+    ) -> None:
         """Osemosys structure.
 
         It generates a ``*.xlsx`` file with the
         SETS and PARAMETERS structure used by OSeMOSYS.
 
+        The faster ``xlsxwriter`` engine is used whenever it is
+        installed. Its ``constant_memory`` mode is not enabled since
+        pandas writes sheets column by column and that mode only
+        accepts cells in row order.
+
         """
         with pd.ExcelWriter(
-            "./OSeInputData.xlsx"
+            "./OSeInputData.xlsx",
+            engine=engine
         ) as writer:
             for sheet, df in data.items():
                 df.to_excel(writer,
@@ -365,12 +330,52 @@ class Input_Data():
 
         return None
 
-    def fill_structure(self):
-        """Populate structure model template."""
+    def write_parquet_oseinput(
+            self,
+            data: dict,
+            out_dir: str = "./OSeInputData"
+    ) -> None:
+        """Osemosys structure as parquet.
+
+        It dumps each SETS and PARAMETERS sheet to
+        ``<out_dir>/<sheet>.parquet`` in parallel, which is
+        much faster than generating the ``*.xlsx`` file
+        for large parameter tables.
+        Note: It requires ``pyarrow`` (or ``fastparquet``).
+
+        """
+        os.makedirs(out_dir, exist_ok=True)
+
+        def write_sheet(item: tuple) -> None:
+            sheet, df = item
+            # Parquet columns must be strings (e.g. years)
+            df.rename(columns=str).to_parquet(
+                os.path.join(out_dir, f"{sheet}.parquet"),
+                index=False
+            )
+
+        with ThreadPoolExecutor() as executor:
+            list(executor.map(write_sheet, data.items()))
+
+        return None
+
+    def fill_structure(
+            self,
+            res: reslac.EnergyMatrix = None,
+            sheets: tuple[str] = None
+    ):
+        """Populate structure model template.
+
+        It takes the built ``res`` if given, otherwise
+        it is built by :py:meth:`oseinput.call_reslac`.
+        Give ``sheets=POPULATED_SHEETS`` to read and write
+        the populated sheets only.
+        """
         # Initialize
         # ---------
-        res = self.call_reslac()
-        ose_data = self.call_template()
+        if res is None:
+            res = self.call_reslac()
+        ose_data = self.call_template(sheets=sheets)
         regions, tech_col, fuel_col, = self.set_sets(res=res)
         parameters = self.set_parameters(res=res)
         accumulated_annual_demand = parameters[0]
@@ -383,10 +388,14 @@ class Input_Data():
         ose_data["REGION"]["VALUE"] = regions
         # PATAMETERS
         sheet01 = "AccumulatedAnnualDemand"
-        ose_data[sheet01]["REGION"] = accumulated_annual_demand["Region"]
-        ose_data[sheet01]["FUEL"] = accumulated_annual_demand["Label"]
-        ose_data[sheet01][2021] = accumulated_annual_demand["Energy_PJ"]
-        ose_data[sheet01][2021] = abs(ose_data[sheet01][2021])
+        demand = pd.DataFrame({
+            "REGION": accumulated_annual_demand["Region"],
+            "FUEL": accumulated_annual_demand["Label"],
+            2021: accumulated_annual_demand["Energy_PJ"]
+        })
+        # Keep template fields (e.g. remaining years)
+        fields = ose_data[sheet01].columns.union(demand.columns, sort=False)
+        ose_data[sheet01] = demand.reindex(columns=fields)
 
         # Generate file
         # -------------
@@ -20,19 +20,231 @@ email: Mario.Peralta@ucr.ac.cr
 The Electric Power and Energy Research Laboratory (EPERLab).
 
 """
+import numpy as np
 import pandas as pd
-import copy
+import functools
+import hashlib
+import importlib.metadata
+import os
+import pickle
+import sys
+import tempfile
+
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = "openpyxl"
+
+# Distribution of each ``pd.read_excel`` engine
+_ENGINE_PACKAGES = {
+    "calamine": "python-calamine",
+    "openpyxl": "openpyxl",
+    "odf": "odfpy",
+    "pyxlsb": "pyxlsb",
+    "xlrd": "xlrd"
+}
+
+
+# Register rows of a country sheet, from "Unit" down to "CONSUMO FINAL";
+# the footnotes below them are not read
+MATRIX_ROWS = 28
+MATRIX_LAST_ROW = "CONSUMO FINAL"
+
+
+def _intern(code: str) -> str:
+    """Intern code so that repeated labels share one object."""
+    if isinstance(code, str):
+        return sys.intern(code)
+    return code
+
+
+def _label_table(tables: list[dict], key: str) -> dict:
+    """Flatten labels dictionaries into ``{name: (group, code)}``.
+
+    The group of each dictionary is stored under ``key``;
+    the first dictionary holding a name wins.
+
+    """
+    labels = {}
+    for table in tables:
+        for name, code in table.items():
+            if name != key:
+                labels.setdefault(_intern(name), (table[key], code))
+    return labels
+
+
+def _clean_sector(name: str) -> str:
+    """Strip and intern a register name, ``Unit`` if empty."""
+    if isinstance(name, str):
+        return sys.intern(name.strip())
+    return "Unit" if pd.isna(name) else name
+
+
+def _index_by_key(items: list) -> dict:
+    """Index techs or fuels by ``_key``, first match wins."""
+    index = {}
+    for item in items:
+        index.setdefault(item._key, item)
+    return index
+
+
+def _pair_by_region(techs: list, code: str, other_code: str) -> list:
+    """Pair ``code`` and ``other_code`` technologies of each region.
+
+    The first technology of each code in a region is taken.
+    Every region must hold both of them or neither, otherwise
+    a ``ValueError`` naming the unpaired regions is raised.
+
+    """
+    techs_by_region = {code: {}, other_code: {}}
+    for T in techs:
+        if T.code in techs_by_region:
+            techs_by_region[T.code].setdefault(T.region, T)
+    firsts = techs_by_region[code]
+    seconds = techs_by_region[other_code]
+    unpaired = sorted(firsts.keys() ^ seconds.keys())
+    if unpaired:
+        raise ValueError(f"{code} and {other_code} technologies are not "
+                         f"paired in region(s): {', '.join(unpaired)}")
+    return [(T, seconds[r]) for r, T in firsts.items()]
+
+
+def _engine_version(engine: str) -> str:
+    """Installed version of the package behind an excel engine."""
+    package = _ENGINE_PACKAGES.get(engine, engine)
+    try:
+        return importlib.metadata.version(package)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def read_workbook(path: str,
+                  cache_dir: str = "./.cache",
+                  **kwargs) -> dict:
+    """Read excel workbook through a pickle cache.
+
+    Parsed sheets are pickled in ``cache_dir`` keyed by the
+    path, modification time and size of the workbook as well
+    as the reading options and the pandas and engine versions
+    so that later runs skip parsing the excel file. Each
+    path and reading options get their own cache file.
+    The cache is best-effort: an unreadable cache file is
+    parsed again and a failing write is ignored. Set
+    ``cache_dir`` to ``None`` to always parse the workbook.
+    Keyword arguments are passed to ``pd.read_excel``.
+
+    """
+    if cache_dir is None:
+        return pd.read_excel(path, **kwargs)
+    stat = os.stat(path)
+    engine = kwargs.get("engine") or "openpyxl"
+    options = (os.path.abspath(path), sorted(kwargs.items()),
+               pd.__version__, _engine_version(engine))
+    key = (*options, stat.st_mtime_ns, stat.st_size)
+    name = os.path.splitext(os.path.basename(path))[0]
+    digest = hashlib.sha1(repr(options).encode()).hexdigest()[:12]
+    cache_path = os.path.join(cache_dir, f"{name}-{digest}.pkl")
+    # Cache hit
+    try:
+        with open(cache_path, "rb") as f:
+            cache_key, dict_df = pickle.load(f)
+        if cache_key == key:
+            return dict_df
+    except Exception:
+        # Unreadable, e.g. truncated or pickled by other versions
+        pass
+
+    dict_df = pd.read_excel(path, **kwargs)
+    _dump_cache(cache_path, (key, dict_df))
+    return dict_df
+
+
+def _dump_cache(cache_path: str, obj) -> None:
+    """Pickle ``obj`` atomically into ``cache_path``, if possible."""
+    cache_dir = os.path.dirname(cache_path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(obj, f)
+        os.replace(tmp_path, cache_path)
+    except (OSError, pickle.PicklingError):
+        pass
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_matrix(path: str,
+                engine: str = EXCEL_ENGINE,
+                cache_dir: str = "./.cache") -> dict:
+    """Read and clean every country sheet of a matrix workbook.
+
+    It gives string format to commodities (fields)
+    and sectors (register).
+    Parsed sheets are cached in ``cache_dir`` by
+    :py:func:`read_workbook` (``None`` disables it) and
+    kept in memory while the file is unchanged, each call
+    getting its own copy of the sheets.
+
+    """
+    stat = os.stat(path)
+    dict_df = _read_matrix(os.path.abspath(path), stat.st_mtime_ns,
+                           stat.st_size, engine, cache_dir)
+    return {sheet: matrix_df.copy() for sheet, matrix_df in dict_df.items()}
+
+
+@functools.lru_cache(maxsize=4)
+def _read_matrix(path: str,
+                 mtime_ns: int,
+                 size: int,
+                 engine: str,
+                 cache_dir: str) -> dict:
+    """Read and clean sheets of ``path`` at a given modification."""
+    dict_df = read_workbook(path, cache_dir=cache_dir, sheet_name=None,
+                            header=4, nrows=MATRIX_ROWS, engine=engine)
+    # Set new columns header
+    for sheet, matrix_df in dict_df.items():
+        values = matrix_df.to_numpy()
+        columns = matrix_df.columns
+        # Empty field of the register is "Sectors"
+        if "Unnamed: 0" not in columns:
+            raise ValueError(
+                f"Sheet {sheet!r} of {path}: no register (sectors) field.")
+        i = columns.get_loc("Unnamed: 0")
+        fuel_cols = [j for j in range(len(columns)) if j != i]
+        # Remove white space in field
+        fields = [_intern(str(columns[j]).strip()) for j in fuel_cols]
+        # Remove white space in register, empty ones are "Unit"
+        sectors = pd.Categorical([_clean_sector(s) for s in values[:, i]])
+        # Register rows must end right at the cut
+        if len(sectors) != MATRIX_ROWS or sectors[-1] != MATRIX_LAST_ROW:
+            raise ValueError(
+                f"Sheet {sheet!r} of {path}: expected {MATRIX_LAST_ROW!r} "
+                f"as register row {MATRIX_ROWS}, the layout has changed.")
+        # Replace all np.NaN obj for 0.0 float type in commodities
+        block = values[:, fuel_cols]
+        block[pd.isna(block)] = 0.0
+        matrix_df = pd.DataFrame(block, columns=fields)
+        matrix_df.insert(i, "Sectors", sectors)
+        dict_df[sheet] = matrix_df
+    return dict_df
 
 
 class Technology():
+    __slots__ = ("code", "region", "category")
 
     def __init__(self,
                  code: str,
                  region: str,
                  category: str):
-        self.code = code
-        self.region = region
-        self.category = category
+        self.code = _intern(code)
+        self.region = _intern(region)
+        self.category = _intern(category)
 
     def __repr__(self) -> str:
         r = self.region
@@ -40,19 +252,18 @@ class Technology():
         cat = self.category
         return f"({cat}, {c}, {r})"
 
+    @property
+    def _key(self) -> tuple:
+        """Identity of the technology: type, category, code, region."""
+        return (type(self), self.category, self.code, self.region)
+
     def __eq__(self, other) -> bool:
-        m_type = type(self)
-        n_type = type(other)
-        m_cat = self.category
-        n_cat = other.category
-        m_c = self.code
-        n_c = other.code
-        m_r = self.region
-        n_r = other.region
-        self_ft = {m_type, m_cat, m_c, m_r}
-        other_ft = {n_type, n_cat, n_c, n_r}
-
-        return self_ft == other_ft
+        if not isinstance(other, Technology):
+            return NotImplemented
+        return self._key == other._key
+
+    def __hash__(self) -> int:
+        return hash(self._key)
 
     def __add__(self, other):
         """Operate TEC.
@@ -67,19 +278,17 @@ class Technology():
             tech_set = {s_code, o_code}
             # Primary loss tech
             if tech_set == {"INV", "WAS"}:
+                other_fuels = _index_by_key(other.out_fuels)
                 for f in self.out_fuels:
-                    energy = other.out_fuels[
-                        other.out_fuels.index(f)
-                    ].energy_PJ
+                    energy = other_fuels[f._key].energy_PJ
                     f.energy_PJ += energy
                 return self
 
             # Demand loss tech
             elif tech_set == {"OWN", "LOS"}:
+                other_fuels = _index_by_key(other.in_fuels)
                 for f in self.in_fuels:
-                    energy = other.in_fuels[
-                        other.in_fuels.index(f)
-                    ].energy_PJ
+                    energy = other_fuels[f._key].energy_PJ
                     f.energy_PJ += energy
                 return self
 
@@ -93,6 +302,7 @@ class Technology():
 
 
 class Primary_Tech(Technology):
+    __slots__ = ("out_fuels",)
 
     def __init__(self,
                  label: str,
@@ -103,6 +313,7 @@ class Primary_Tech(Technology):
 
 
 class Supply_Tech(Technology):
+    __slots__ = ("in_fuels", "out_fuels", "order")
 
     def __init__(self,
                  label: str,
@@ -116,6 +327,7 @@ class Supply_Tech(Technology):
 
 
 class Convertion_Tech(Technology):
+    __slots__ = ("in_fuels", "out_fuels")
 
     def __init__(self,
                  label: str,
@@ -127,6 +339,7 @@ class Convertion_Tech(Technology):
 
 
 class Demand_Tech(Technology):
+    __slots__ = ("in_fuels",)
 
     def __init__(self,
                  label: str,
@@ -137,51 +350,58 @@ class Demand_Tech(Technology):
 
 
 class Fuel():
+    __slots__ = ("code", "energy_PJ", "region")
 
     def __init__(
             self, code: str,
             energy: float, region: str
     ):
-        self.code = code
+        self.code = _intern(code)
         self.energy_PJ = energy
-        self.region = region
+        self.region = _intern(region)
 
     def __repr__(self) -> str:
         c = self.code
         r = self.region
         return f"({c}, {r})"
 
+    @property
+    def _key(self) -> tuple:
+        """Identity of the fuel: type, code, region."""
+        return (type(self), self.code, self.region)
+
     def __eq__(self, other) -> bool:
-        m_type = type(self)
-        n_type = type(other)
-        m_c = self.code
-        n_c = other.code
-        m_r = self.region
-        n_r = other.region
-        self_ft = {m_type, m_c, m_r}
-        other_ft = {n_type, n_c, n_r}
-        return self_ft == other_ft
+        if not isinstance(other, Fuel):
+            return NotImplemented
+        return self._key == other._key
+
+    def __hash__(self) -> int:
+        return hash(self._key)
 
 
 class Primary_Fuel(Fuel):
+    __slots__ = ()
 
     def __init__(self, code: str, energy: float, region: str):
         super().__init__(code, energy, region)
 
 
 class Second_Fuel(Fuel):
+    __slots__ = ()
 
     def __init__(self, code: str, energy: float, region: str):
         super().__init__(code, energy, region)
 
 
 class Third_Fuel(Fuel):
+    __slots__ = ()
 
     def __init__(self, code: str, energy: float, region: str):
         super().__init__(code, energy, region)
 
 
 class Supply_Fuel(Fuel):
+    __slots__ = ("order",)
 
     def __init__(self,
                  order: int,
@@ -191,6 +411,34 @@ class Supply_Fuel(Fuel):
         self.order = order
 
 
+# Fuel class of each sector
+_FUEL_CLS = {
+    "FUE001": Primary_Fuel,
+    "FUE002": Second_Fuel,
+    "FUE003": Third_Fuel
+}
+
+# Kind of technology of each category
+_CATEGORY_KIND = {
+    # Primary tech
+    "SUP": "prim",
+    "LOS001": "prim",
+    # Convertion tech
+    "UPS001": "conv",
+    "UPS002": "conv",
+    "UPS003": "conv",
+    # Demand tech
+    "DEM": "dem",
+    "LOS002": "dem"
+}
+
+# Technology class of each category
+_TECH_CLS = {category: {"prim": Primary_Tech,
+                        "conv": Convertion_Tech,
+                        "dem": Demand_Tech}[kind]
+             for category, kind in _CATEGORY_KIND.items()}
+
+
 class EnergyMatrix():
 
     def __init__(self):
@@ -201,33 +449,44 @@ class EnergyMatrix():
         self.labels = []    # To instance capacities fuels
         self._techs = []    # Intances to be updated
         self._fuels = []    # Intances to be updated
-
-    def read_data(self, path: str = "./data/matrix.xlsx") -> dict:
+        # Technology setter and initial flow of each category
+        setters = {
+            "prim": self.set_prim_tech,
+            "conv": self.set_conv_tech,
+            "dem": self.set_demand_tech
+        }
+        flows = {
+            "prim": self.prim_tech_flow,
+            "conv": self.conv_tech_flow,
+            "dem": self.dem_tech_flow
+        }
+        self._tech_setters = {category: setters[kind]
+                              for category, kind in _CATEGORY_KIND.items()}
+        self._tech_flows = {category: flows[kind]
+                            for category, kind in _CATEGORY_KIND.items()}
+
+    def read_data(self,
+                  path: str = "./data/matrix.xlsx",
+                  engine: str = EXCEL_ENGINE,
+                  cache_dir: str = "./.cache") -> dict:
         """Read Energetic Balance Matrix data.
 
         It gives string format to commodities (fields)
         and sectors (register).
+        The ``calamine`` engine is used whenever
+        ``python-calamine`` is installed, ``openpyxl`` otherwise.
+        Sheets are read by :py:func:`read_matrix`, cached in
+        ``cache_dir`` (``None`` disables the cache).
 
         """
-        dict_df = pd.read_excel(path, sheet_name=None, header=4)
-        # Set new columns header
-        for matrix_df in dict_df.values():
-            # Replace empty values in fields by "Sectors"
-            matrix_df.rename(columns={"Unnamed: 0": "Sectors"}, inplace=True)
-            # In register by "Unit"
-            matrix_df["Sectors"] = matrix_df["Sectors"].fillna("Unit")
-            # Remove white space in field
-            matrix_df.columns = matrix_df.columns.str.strip()
-            # Remove white space in register
-            matrix_df["Sectors"] = matrix_df["Sectors"].str.strip()
-            # Replace all np.NaN obj for 0.0 float type
-            matrix_df.fillna(0.0, inplace=True)
-
+        dict_df = read_matrix(path, engine=engine, cache_dir=cache_dir)
         self.matrix = dict_df
         return dict_df
 
     def read_base(self,
-                  path: str = "./data/capacities.xlsx") -> dict:
+                  path: str = "./data/capacities.xlsx",
+                  engine: str = EXCEL_ENGINE,
+                  cache_dir: str = "./.cache") -> dict:
         """Read Capacities Matrix data.
 
         It reads binary matrix:
@@ -236,21 +495,11 @@ class EnergyMatrix():
             - ``0`` No chance whatsoever to somehow describe
               the energy system because of technical incompatibility.
 
-        """
-        dict_df = pd.read_excel(path, sheet_name=None, header=4)
-        # Set new columns header
-        for matrix_df in dict_df.values():
-            # Replace empty values in fields by "Sectors"
-            matrix_df.rename(columns={"Unnamed: 0": "Sectors"}, inplace=True)
-            # In register by "Unit"
-            matrix_df["Sectors"] = matrix_df["Sectors"].fillna("Unit")
-            # Remove white space in field
-            matrix_df.columns = matrix_df.columns.str.strip()
-            # Remove white space in register
-            matrix_df["Sectors"] = matrix_df["Sectors"].str.strip()
-            # Replace all np.NaN obj for 0.0 float type
-            matrix_df.fillna(0.0, inplace=True)
+        Sheets are read by :py:func:`read_matrix`, cached in
+        ``cache_dir`` (``None`` disables the cache).
 
+        """
+        dict_df = read_matrix(path, engine=engine, cache_dir=cache_dir)
         self.res = dict_df
         return dict_df
 
@@ -283,22 +532,19 @@ class EnergyMatrix():
                       tech_code,
                       region,
                       category,
-                      matrix_df,
-                      n) -> Primary_Tech:
+                      row,
+                      fuel_fields) -> Primary_Tech:
         tech = self.add_prim_tech(tech_code, region, category)
+        # Primary fuels only produced
+        if tech_code == "PRO":
+            fuel_fields = [ft for ft in fuel_fields if ft[1] == "FUE001"]
+        # Negative
+        sign = -1 if tech_code in {"EXP", "WAS"} else 1
         # Add all output primary fuels to this same instance
-        for field in matrix_df.columns:
-            fuelID = set_fuel_labels(field)
-            if not fuelID:
-                continue
-            sector, fuel_code = fuelID
-            if tech_code == "PRO" and sector in {"FUE002", "FUE003"}:
-                continue
-            energy = matrix_df[field][n]
-            if tech_code in {"EXP", "WAS"}:
-                energy = -energy    # Negative
-            fuel = self.add_fuel(sector, fuel_code, energy, region)
-            tech.out_fuels.append(fuel)
+        fuels = [_FUEL_CLS[sector](fuel_code, sign * row[j], region)
+                 for j, sector, fuel_code in fuel_fields]
+        self.fuels.extend(fuels)
+        tech.out_fuels.extend(fuels)
 
         return tech
 
@@ -306,19 +552,15 @@ class EnergyMatrix():
                       tech_code,
                       region,
                       category,
-                      matrix_df,
-                      n) -> Convertion_Tech:
+                      row,
+                      fuel_fields) -> Convertion_Tech:
         tech = self.add_conv_tech(tech_code, region, category)
-        for field in matrix_df.columns:
-            fuelID = set_fuel_labels(field)
-            if not fuelID:
-                continue
-            sector, fuel_code = fuelID
-            # Primary fuel as inputs only
-            if category == "UPS001":
+        # Primary fuel as inputs only
+        if category == "UPS001":
+            for j, sector, fuel_code in fuel_fields:
                 if sector == "FUE003":
                     continue
-                energy = matrix_df[field][n]
+                energy = row[j]
                 fuel = self.add_fuel(sector, fuel_code, energy, region)
                 # Input
                 if sector == "FUE001":
@@ -327,18 +569,20 @@ class EnergyMatrix():
                 elif sector == "FUE002":
                     tech.out_fuels.append(fuel)
 
-            elif category == "UPS002":
+        elif category == "UPS002":
+            for j, sector, fuel_code in fuel_fields:
                 if sector == "FUE003":
                     continue
-                energy = matrix_df[field][n]
+                energy = row[j]
                 fuel = self.add_fuel(sector, fuel_code, energy, region)
                 tech.in_fuels.append(fuel)
                 if sector == "FUE002":
-                    fuel = copy.deepcopy(fuel)
+                    fuel = Second_Fuel(fuel.code, fuel.energy_PJ, fuel.region)
                     tech.out_fuels.append(fuel)
 
-            elif category == "UPS003":
-                energy = matrix_df[field][n]
+        elif category == "UPS003":
+            for j, sector, fuel_code in fuel_fields:
+                energy = row[j]
                 fuel = self.add_fuel(sector, fuel_code, energy, region)
                 if sector == "FUE003":
                     tech.out_fuels.append(fuel)
@@ -351,17 +595,14 @@ class EnergyMatrix():
                         tech_code,
                         region,
                         category,
-                        matrix_df,
-                        n) -> Demand_Tech:
+                        row,
+                        fuel_fields) -> Demand_Tech:
         tech = self.add_demand_tech(tech_code, region, category)
-        for field in matrix_df.columns:
-            fuelID = set_fuel_labels(field)
-            if not fuelID:
-                continue
-            sector, fuel_code = fuelID
-            energy = -matrix_df[field][n]   # Negative as input
-            fuel = self.add_fuel(sector, fuel_code, energy, region)
-            tech.in_fuels.append(fuel)
+        # Negative as input
+        fuels = [_FUEL_CLS[sector](fuel_code, -row[j], region)
+                 for j, sector, fuel_code in fuel_fields]
+        self.fuels.extend(fuels)
+        tech.in_fuels.extend(fuels)
 
         return tech
 
@@ -369,33 +610,16 @@ class EnergyMatrix():
                  tech_code: str,
                  region: str,
                  category: str,
-                 matrix_df: pd.DataFrame,
-                 n: int) -> Technology:
-        """Create and add technology instance."""
-        # Primary tech
-        if category in {"SUP", "LOS001"}:
-            tech = self.set_prim_tech(tech_code,
-                                      region,
-                                      category,
-                                      matrix_df,
-                                      n)
-
-        # Convertion tech
-        elif category in {"UPS001", "UPS002", "UPS003"}:
-            tech = self.set_conv_tech(tech_code,
-                                      region,
-                                      category,
-                                      matrix_df,
-                                      n)
-
-        # Demand tech
-        elif category in {"DEM", "LOS002"}:
-            tech = self.set_demand_tech(tech_code,
-                                        region,
-                                        category,
-                                        matrix_df,
-                                        n)
-        return tech
+                 row: np.ndarray,
+                 fuel_fields: list[tuple]) -> Technology:
+        """Create and add technology instance.
+
+        The energy of each fuel is taken from ``row`` (values of the
+        sector in the matrix) at the column index given in
+        ``fuel_fields`` as ``(index, sector, fuel_code)``.
+        """
+        set_tech = self._tech_setters[category]
+        return set_tech(tech_code, region, category, row, fuel_fields)
 
     def add_prim_fuel(self, code, energy, region) -> Primary_Fuel:
         prim_fuel = Primary_Fuel(code, energy, region)
@@ -416,15 +640,8 @@ class EnergyMatrix():
                  sector: str,
                  fuel_code: str,
                  energy: float, region: str) -> Fuel:
-        # Primary fuel
-        if sector == "FUE001":
-            fuel = self.add_prim_fuel(fuel_code, energy, region)
-        # Second fuel
-        elif sector == "FUE002":
-            fuel = self.add_sec_fuel(fuel_code, energy, region)
-        # Third fuel
-        elif sector == "FUE003":
-            fuel = self.add_third_fuel(fuel_code, energy, region)
+        fuel = _FUEL_CLS[sector](fuel_code, energy, region)
+        self.fuels.append(fuel)
         return fuel
 
     def add_supply_tech(self):
@@ -437,52 +654,45 @@ class EnergyMatrix():
         """UPS002 input and output fuels."""
         techs = self.techs
         conv_techs = [t for t in techs if t.category == "UPS002"]
-        for c in conv_techs:
-            for f in c.in_fuels:
-                if f.energy_PJ > 0:
-                    f.energy_PJ = 0
-            for f in c.out_fuels:
-                if f.energy_PJ < 0:
-                    f.energy_PJ = 0
+        in_fuels = [f for c in conv_techs for f in c.in_fuels]
+        out_fuels = [f for c in conv_techs for f in c.out_fuels]
+        # Compare all energies at once, then reset only the flagged fuels
+        for fuels, mask in ((in_fuels, np.greater), (out_fuels, np.less)):
+            energy = np.fromiter((f.energy_PJ for f in fuels),
+                                 dtype=np.float64, count=len(fuels))
+            for i in np.flatnonzero(mask(energy, 0)):
+                fuels[i].energy_PJ = 0
 
     def obj_labels(self) -> list[tuple[str]]:
         """Set objects labels to be instantiated."""
         dict_df = self.read_base()
         # Iterate over data
         for country, matrix_df in dict_df.items():
-            region = country.split(" - ")[1]
-            region = set_region(region)
-            sectors = matrix_df["Sectors"]
-            for n, tech in enumerate(sectors):
-                techID = set_technology_labels(tech)
-                if not techID:
-                    continue
-                category, tech_code = techID
-                for field in matrix_df.columns:
-                    fuelID = set_fuel_labels(field)
-                    if fuelID:
-                        sector, fuel_code = fuelID
-                        energy = matrix_df[field][n]
-                        if energy:
-                            fuel_str = (category,
-                                        tech_code,
-                                        sector,
-                                        fuel_code,
-                                        region)
-                            self.labels.append(fuel_str)
-
+            region = sheet_region(country)
+            # Label sectors and fuels once per sheet
+            techIDs = set_sector_fields(matrix_df["Sectors"])
+            fuel_fields = set_fuel_fields(matrix_df.columns)
+            rows = [n for n, techID in enumerate(techIDs) if techID]
+            cols = [j for j, _, _ in fuel_fields]
+            # Non-zero cells of technologies and fuels, row by row
+            mask = matrix_df.to_numpy()[np.ix_(rows, cols)].astype(bool)
+            for n, j in zip(*np.nonzero(mask)):
+                category, tech_code = techIDs[rows[n]]
+                _, sector, fuel_code = fuel_fields[j]
+                fuel_str = (category,
+                            tech_code,
+                            sector,
+                            fuel_code,
+                            region)
+                self.labels.append(fuel_str)
+        # Remove duplicates, keeping the order of the sheets
+        self.labels = list(dict.fromkeys(self.labels))
         return self.labels
 
     def add_ifuel(self, sector, fuel_code, region) -> Fuel:
         """Initialize fuels."""
         energy = 0   # Initial value
-        if sector == "FUE001":
-            fuel = Primary_Fuel(fuel_code, energy, region)
-        elif sector == "FUE002":
-            fuel = Second_Fuel(fuel_code, energy, region)
-        elif sector == "FUE003":
-            fuel = Third_Fuel(fuel_code, energy, region)
-
+        fuel = _FUEL_CLS[sector](fuel_code, energy, region)
         self._fuels.append(fuel)
         return fuel
 
@@ -491,16 +701,7 @@ class EnergyMatrix():
                   tech_code,
                   region) -> Technology:
         """Initialzile technologies."""
-        # Primary tech
-        if category in {"SUP", "LOS001"}:
-            tech = Primary_Tech(tech_code, region, category)
-        # Convertion tech
-        elif category in {"UPS001", "UPS002", "UPS003"}:
-            tech = Convertion_Tech(tech_code, region, category)
-        # Demand tech
-        elif category in {"DEM", "LOS002"}:
-            tech = Demand_Tech(tech_code, region, category)
-
+        tech = _TECH_CLS[category](tech_code, region, category)
         self._techs.append(tech)
         return tech
 
@@ -508,17 +709,8 @@ class EnergyMatrix():
                        tech: Technology,
                        obj_labels: list[tuple[str]]) -> Primary_Tech:
         # Output
-        tech_code = tech.code
-        region = tech.region
-        filter = {tech_code,
-                  region,
-                  "FUE001",
-                  "FUE002",
-                  "FUE003"}
-        out_fuels = list({ft for ft in obj_labels
-                         if {ft[1], ft[2], ft[-1]}.issubset(filter)})
         out_fuels = [self.add_ifuel(s, f, r)
-                     for _, _, s, f, r in out_fuels]
+                     for _, _, s, f, r in obj_labels]
         tech.out_fuels = out_fuels
 
         return tech
@@ -527,55 +719,47 @@ class EnergyMatrix():
                        tech: Technology,
                        obj_labels: list[tuple[str]]) -> Convertion_Tech:
         category = tech.category
-        tech_code = tech.code
-        region = tech.region
 
         if category == "UPS001":
             # Input
-            in_filter = {tech_code, "FUE001", region}
-            in_fuels = list({ft for ft in obj_labels
-                             if {ft[1], ft[2], ft[-1]}.issubset(in_filter)})
+            in_filter = {"FUE001"}
             in_fuels = [self.add_ifuel(s, f, r)
-                        for _, _, s, f, r in in_fuels]
+                        for _, _, s, f, r in obj_labels
+                        if s in in_filter]
             tech.in_fuels = in_fuels
             # Output
-            out_filter = {tech_code, "FUE002", region}
-            out_fuels = list({ft for ft in obj_labels
-                              if {ft[1], ft[2], ft[-1]}.issubset(out_filter)})
+            out_filter = {"FUE002"}
             out_fuels = [self.add_ifuel(s, f, r)
-                         for _, _, s, f, r in out_fuels]
+                         for _, _, s, f, r in obj_labels
+                         if s in out_filter]
             tech.out_fuels = out_fuels
 
         elif category == "UPS002":
             # Input: for negative values of FUE002
-            in_filter = {tech_code, "FUE001", "FUE002", region}
-            in_fuels = list({ft for ft in obj_labels
-                            if {ft[1], ft[2], ft[-1]}.issubset(in_filter)})
+            in_filter = {"FUE001", "FUE002"}
             in_fuels = [self.add_ifuel(s, f, r)
-                        for _, _, s, f, r in in_fuels]
+                        for _, _, s, f, r in obj_labels
+                        if s in in_filter]
             tech.in_fuels = in_fuels
             # Output: for positive values of FUE002
-            out_filter = {tech_code, "FUE002", region}
-            out_fuels = list({ft for ft in obj_labels
-                              if {ft[1], ft[2], ft[-1]}.issubset(out_filter)})
+            out_filter = {"FUE002"}
             out_fuels = [self.add_ifuel(s, f, r)
-                         for _, _, s, f, r in out_fuels]
+                         for _, _, s, f, r in obj_labels
+                         if s in out_filter]
             tech.out_fuels = out_fuels
 
         elif category == "UPS003":
             # Input
-            in_filter = {tech_code, "FUE001", "FUE002", region}
-            in_fuels = list({ft for ft in obj_labels
-                             if {ft[1], ft[2], ft[-1]}.issubset(in_filter)})
+            in_filter = {"FUE001", "FUE002"}
             in_fuels = [self.add_ifuel(s, f, r)
-                        for _, _, s, f, r in in_fuels]
+                        for _, _, s, f, r in obj_labels
+                        if s in in_filter]
             tech.in_fuels = in_fuels
             # Output
-            out_filter = {tech_code, "FUE003", region}
-            out_fuels = list({ft for ft in obj_labels
-                              if {ft[1], ft[2], ft[-1]}.issubset(out_filter)})
+            out_filter = {"FUE003"}
             out_fuels = [self.add_ifuel(s, f, r)
-                         for _, _, s, f, r in out_fuels]
+                         for _, _, s, f, r in obj_labels
+                         if s in out_filter]
             tech.out_fuels = out_fuels
 
         return tech
@@ -584,17 +768,8 @@ class EnergyMatrix():
                       tech: Technology,
                       obj_labels: list[tuple[str]]) -> Demand_Tech:
         # Income only
-        tech_code = tech.code
-        region = tech.region
-        in_filter = {tech_code,
-                     "FUE001",
-                     "FUE002",
-                     "FUE003",
-                     region}
-        in_fuels = list({ft for ft in obj_labels
-                        if {ft[1], ft[2], ft[-1]}.issubset(in_filter)})
         in_fuels = [self.add_ifuel(s, f, r)
-                    for _, _, s, f, r in in_fuels]
+                    for _, _, s, f, r in obj_labels]
         tech.in_fuels = in_fuels
         return tech
 
@@ -607,18 +782,18 @@ class EnergyMatrix():
         It initializes fuel flows in zero.
         """
         obj_labels = self.obj_labels()
+        # Group labels by technology and region
+        tech_labels = {}
+        for ft in obj_labels:
+            tech_labels.setdefault((ft[1], ft[-1]), []).append(ft)
         # Filter techs
-        techs = list({(ft[0], ft[1], ft[-1]) for ft in obj_labels})
+        techs = dict.fromkeys((ft[0], ft[1], ft[-1]) for ft in obj_labels)
         # Add techs
         for category, tech_code, region in techs:
             tech = self.add_itech(category, tech_code, region)
+            labels = tech_labels[(tech_code, region)]
             # Add initial fuels
-            if category in {"SUP", "LOS001"}:
-                tech = self.prim_tech_flow(tech, obj_labels)
-            elif category in {"UPS001", "UPS002", "UPS003"}:
-                tech = self.conv_tech_flow(tech, obj_labels)
-            elif category in {"DEM", "LOS002"}:
-                tech = self.dem_tech_flow(tech, obj_labels)
+            tech = self._tech_flows[category](tech, labels)
 
         return self._techs
 
@@ -631,19 +806,20 @@ class EnergyMatrix():
         dict_df = self.read_data()
         # Iterate over data
         for country, matrix_df in dict_df.items():
-            region = country.split(" - ")[1]
-            region = set_region(region)
-            sectors = matrix_df["Sectors"]
-            for n, tech in enumerate(sectors):
-                techID = set_technology_labels(tech)
+            region = sheet_region(country)
+            # Label sectors and fuels once per sheet
+            techIDs = set_sector_fields(matrix_df["Sectors"])
+            fuel_fields = set_fuel_fields(matrix_df.columns)
+            values = matrix_df.to_numpy()
+            for n, techID in enumerate(techIDs):
                 if not techID:
                     continue
                 category, tech_code = techID
                 tech = self.add_tech(tech_code,
                                      region,
                                      category,
-                                     matrix_df,
-                                     n)
+                                     values[n],
+                                     fuel_fields)
         # UPS002 flow
         self.split_flow()
         return self.techs
@@ -655,59 +831,52 @@ class EnergyMatrix():
         with the actual in the balance matrix.
         """
         itechs = self.initital_RES()
-        techs = self.data_RES()
+        techs = _index_by_key(self.data_RES())
         for T in itechs:
-            t = techs[techs.index(T)]
-            if T.category in {"SUP", "LOS001"}:
+            t = techs[T._key]
+            kind = _CATEGORY_KIND[T.category]
+            if kind == "prim":
+                out_fuels = _index_by_key(t.out_fuels)
                 for f in T.out_fuels:
-                    out_fuel = t.out_fuels[t.out_fuels.index(f)]
-                    f.energy_PJ = out_fuel.energy_PJ
+                    f.energy_PJ = out_fuels[f._key].energy_PJ
 
-            elif T.category in {"UPS001", "UPS002", "UPS003"}:
+            elif kind == "conv":
+                in_fuels = _index_by_key(t.in_fuels)
                 for f in T.in_fuels:
-                    in_fuel = t.in_fuels[t.in_fuels.index(f)]
-                    f.energy_PJ = in_fuel.energy_PJ
+                    f.energy_PJ = in_fuels[f._key].energy_PJ
 
+                out_fuels = _index_by_key(t.out_fuels)
                 for f in T.out_fuels:
-                    out_fuel = t.out_fuels[t.out_fuels.index(f)]
-                    f.energy_PJ = out_fuel.energy_PJ
+                    f.energy_PJ = out_fuels[f._key].energy_PJ
 
-            elif T.category in {"DEM", "LOS002"}:
+            elif kind == "dem":
+                in_fuels = _index_by_key(t.in_fuels)
                 for f in T.in_fuels:
-                    in_fuel = t.in_fuels[t.in_fuels.index(f)]
-                    f.energy_PJ = in_fuel.energy_PJ
+                    f.energy_PJ = in_fuels[f._key].energy_PJ
 
         return itechs
 
     def sum_prim_loss_tech(self, techs: list) -> None:
         """Operate primary loss technology: LOS001."""
-        # Filter regions
-        regions = list({T.region for T in techs})
         # Operate WAS & INV techs for each region
-        for r in regions:
-            was_tech = [T for T in techs
-                        if all((T.code == "WAS", T.region == r))][0]
-            inv_tech = [T for T in techs
-                        if all((T.code == "INV", T.region == r))][0]
+        removed = set()
+        for was_tech, inv_tech in _pair_by_region(techs, "WAS", "INV"):
             # Operate
             _ = was_tech + inv_tech
             # Remove INV tech
-            self._techs.remove(inv_tech)
+            removed.add(inv_tech)
+        self._techs[:] = [T for T in self._techs if T not in removed]
 
     def sum_sec_loss_tech(self, techs: list) -> None:
         """Operate secondary loss technology: LOS002."""
-        # Filter regions
-        regions = list({T.region for T in techs})
         # Operate OWN & LOS techs for each region
-        for r in regions:
-            own_tech = [T for T in techs
-                        if all((T.code == "OWN", T.region == r))][0]
-            los_tech = [T for T in techs
-                        if all((T.code == "LOS", T.region == r))][0]
+        removed = set()
+        for own_tech, los_tech in _pair_by_region(techs, "OWN", "LOS"):
             # Operate: Update OWN
             _ = own_tech + los_tech
             # Remove LOS tech
-            self._techs.remove(los_tech)
+            removed.add(los_tech)
+        self._techs[:] = [T for T in self._techs if T not in removed]
 
     def build_RES(self) -> list[Technology]:
         """Reduce RES.
@@ -721,6 +890,37 @@ class EnergyMatrix():
         return self._techs
 
 
+_REGIONS = {
+    "Argentina": "ARG",
+    "Barbados": "BRB",
+    "Belice": "BLZ",
+    "Bolivia": "BOL",
+    "Brasil": "BRA",
+    "Chile": "CHL",
+    "Colombia": "COL",
+    "Costa Rica": "CRI",
+    "Cuba": "CUB",
+    "Ecuador": "ECU",
+    "El Salvador": "SLV",
+    "Grenada": "GRD",
+    "Guatemala": "GTM",
+    "Guyana": "GUY",
+    "Haiti": "HTI",
+    "Honduras": "HND",
+    "Jamaica": "JAM",
+    "México": "MEX",
+    "Nicaragua": "NIC",
+    "Panamá": "PAN",
+    "Paraguay": "PRY",
+    "Perú": "PER",
+    "República Dominicana": "DOM",
+    "Suriname": "SUR",
+    "Trinidad & Tobago": "TTO",
+    "Uruguay": "URY",
+    "Venezuela": "VEN"
+}
+
+
 def set_region(country: str) -> str:
     """Set regions name up.
 
@@ -757,39 +957,62 @@ def set_region(country: str) -> str:
     }
 
     """
-    region = {
-        "Argentina": "ARG",
-        "Barbados": "BRB",
-        "Belice": "BLZ",
-        "Bolivia": "BOL",
-        "Brasil": "BRA",
-        "Chile": "CHL",
-        "Colombia": "COL",
-        "Costa Rica": "CRI",
-        "Cuba": "CUB",
-        "Ecuador": "ECU",
-        "El Salvador": "SLV",
-        "Grenada": "GRD",
-        "Guatemala": "GTM",
-        "Guyana": "GUY",
-        "Haiti": "HTI",
-        "Honduras": "HND",
-        "Jamaica": "JAM",
-        "México": "MEX",
-        "Nicaragua": "NIC",
-        "Panamá": "PAN",
-        "Paraguay": "PRY",
-        "Perú": "PER",
-        "República Dominicana": "DOM",
-        "Suriname": "SUR",
-        "Trinidad & Tobago": "TTO",
-        "Uruguay": "URY",
-        "Venezuela": "VEN"
-    }
-    if country in region:
-        return region[country]
-    else:
-        return False
+    return _REGIONS.get(country, False)
+
+
+def sheet_region(sheet: str) -> str:
+    """Region code of a ``"<year> - <country>"`` sheet.
+
+    A ``ValueError`` naming the sheet is raised for an
+    unknown country instead of labelling it ``False``.
+
+    """
+    _, _, country = sheet.partition(" - ")
+    region = set_region(country)
+    if not region:
+        raise ValueError(f"Sheet {sheet!r}: unknown country {country!r}, "
+                         "add it to the regions of set_region.")
+    return region
+
+
+# Fuels
+# -----
+_PRIM_FUEL_LABELS = {
+    "Sector": "FUE001",
+    "PETRÓLEO": "CRU",
+    "GAS NATURAL": "NGS",
+    "CARBÓN MINERAL": "COA001",
+    "HIDROENERGÍA": "HYD",
+    "GEOTERMIA": "GEO",
+    "NUCLEAR": "NUC",
+    "LEÑA": "WOO",
+    "CAÑA DE AZÚCAR Y DERIVADOS": "SGC",
+    "OTRAS PRIMARIAS": "OPR"
+}
+_SEC_FUEL_LABELS = {
+    "Sector": "FUE002",
+    "GAS LICUADO DE PETRÓLEO": "LPG",
+    "GASOLINA/ALCOHOL": "GSL",
+    "KEROSENE/JET FUEL": "KER",
+    "DIÉSEL OIL": "DSL",
+    "FUEL OIL": "HFO",
+    "COQUE": "COK",
+    "CARBÓN VEGETAL": "COA002",
+    "GASES": "GAS",
+    "OTRAS SECUNDARIAS": "OSE",
+    "NO ENERGÉTICO": "NEN"
+}
+_THIRD_FUEL_LABELS = {
+    "Sector": "FUE003",
+    "ELECTRICIDAD": "ELC"
+}
+
+_FUEL_LABELS = _label_table([
+    _PRIM_FUEL_LABELS,
+    _SEC_FUEL_LABELS,
+    _THIRD_FUEL_LABELS
+], "Sector")
+_get_fuel_label = _FUEL_LABELS.get
 
 
 def set_fuel_labels(name: str) -> tuple:
@@ -799,47 +1022,90 @@ def set_fuel_labels(name: str) -> tuple:
     so that the OSeMOSYS code naming can be set up.
 
     """
-    # Fuels
-    # -----
-    prim_fuel_labels = {
-        "Sector": "FUE001",
-        "PETRÓLEO": "CRU",
-        "GAS NATURAL": "NGS",
-        "CARBÓN MINERAL": "COA001",
-        "HIDROENERGÍA": "HYD",
-        "GEOTERMIA": "GEO",
-        "NUCLEAR": "NUC",
-        "LEÑA": "WOO",
-        "CAÑA DE AZÚCAR Y DERIVADOS": "SGC",
-        "OTRAS PRIMARIAS": "OPR"
-    }
-    sec_fuel_labels = {
-        "Sector": "FUE002",
-        "GAS LICUADO DE PETRÓLEO": "LPG",
-        "GASOLINA/ALCOHOL": "GSL",
-        "KEROSENE/JET FUEL": "KER",
-        "DIÉSEL OIL": "DSL",
-        "FUEL OIL": "HFO",
-        "COQUE": "COK",
-        "CARBÓN VEGETAL": "COA002",
-        "GASES": "GAS",
-        "OTRAS SECUNDARIAS": "OSE",
-        "NO ENERGÉTICO": "NEN"
-    }
-    third_fuel_labels = {
-        "Sector": "FUE003",
-        "ELECTRICIDAD": "ELC"
-    }
+    return _get_fuel_label(name, False)
 
-    commodities = [prim_fuel_labels,
-                   sec_fuel_labels,
-                   third_fuel_labels]
-    for c in commodities:
-        if name in c:
-            return (c["Sector"], c[name])
-        else:
-            continue
-    return False
+
+def set_fuel_fields(columns: list[str]) -> list[tuple]:
+    """Label commodities (fields) of a matrix once.
+
+    It gives the position of each commodity column
+    as ``(index, sector, fuel_code)``, skipping the
+    fields that are not commodities.
+
+    """
+    fuel_fields = []
+    for j, field in enumerate(columns):
+        fuelID = _get_fuel_label(field)
+        if fuelID:
+            fuel_fields.append((j, *fuelID))
+    return fuel_fields
+
+
+# Supply category
+# ---------------
+_SUPPLY = {
+    "Category": "SUP",
+    "PRODUCCIÓN": "PRO",
+    "IMPORTACIÓN": "IMP",
+    "EXPORTACIÓN": "EXP"
+}
+
+# Transformation
+# --------------
+# Conversion technology
+_SEC_TECH = {
+    "Category": "UPS001",
+    "REFINERÍAS": "REF",
+    "CENTROS DE GAS": "GAS",
+    "CARBONERA": "CHL",
+    "DESTILERÍA": "DET"
+}
+_THIRD_TECH = {
+    "Category": "UPS002",
+    "COQUERÍA Y ALTOS HORNOS": "BOI",
+    "OTROS CENTROS": "UPSTEC"
+}
+_FOURTH_TECH = {
+    "Category": "UPS003",
+    "CENTRALES ELÉCTRICAS": "PWR",
+    "AUTOPRODUCTORES": "SEL"
+}
+# Energy demand category
+# ----------------------
+_DEMAND = {
+    "Category": "DEM",
+    "TRANSPORTE": "TRA",
+    "INDUSTRIAL": "IND",
+    "RESIDENCIAL": "RES",
+    "COMERCIAL, SERVICIOS, PÚBLICO": "COM",
+    "AGRO, PESCA Y MINERÍA": "AGR",
+    "CONSTRUCCIÓN Y OTROS": "CON",
+    "CONSUMO NO ENERGÉTICO": "NEE"
+}
+
+# Loss technology
+# ----------------
+_LOSS_TECH01 = {
+    "Category": "LOS001",
+    "VARIACIÓN DE INVENTARIOS": "INV",
+    "NO APROVECHADO": "WAS",
+}
+
+_LOSS_TECH02 = {
+    "Category": "LOS002",
+    "PÉRDIDAS": "LOS",
+    "CONSUMO PROPIO": "OWN"
+}
+
+_TECH_LABELS = _label_table([
+    _SUPPLY,
+    _SEC_TECH,
+    _THIRD_TECH,
+    _FOURTH_TECH,
+    _DEMAND,
+    _LOSS_TECH01,
+    _LOSS_TECH02
+], "Category")
 
 
 def set_technology_labels(name: str) -> str:
@@ -864,78 +1130,18 @@ def set_technology_labels(name: str) -> str:
     whose category will be ``LOS`` that stands for loss.
 
     """
-    # Supply category
-    # ---------------
-    supply = {
-        "Category": "SUP",
-        "PRODUCCIÓN": "PRO",
-        "IMPORTACIÓN": "IMP",
-        "EXPORTACIÓN": "EXP"
-    }
+    return _TECH_LABELS.get(name, False)
 
-    # Transformation
-    # --------------
-    # Conversion technology
-    sec_tech = {
-        "Category": "UPS001",
-        "REFINERÍAS": "REF",
-        "CENTROS DE GAS": "GAS",
-        "CARBONERA": "CHL",
-        "DESTILERÍA": "DET"
-    }
-    third_tech = {
-        "Category": "UPS002",
-        "COQUERÍA Y ALTOS HORNOS": "BOI",
-        "OTROS CENTROS": "UPSTEC"
-    }
-    fourth_tech = {
-        "Category": "UPS003",
-        "CENTRALES ELÉCTRICAS": "PWR",
-        "AUTOPRODUCTORES": "SEL"
-    }
-    # Energy demand category
-    # ----------------------
-    demand = {
-        "Category": "DEM",
-        "TRANSPORTE": "TRA",
-        "INDUSTRIAL": "IND",
-        "RESIDENCIAL": "RES",
-        "COMERCIAL, SERVICIOS, PÚBLICO": "COM",
-        "AGRO, PESCA Y MINERÍA": "AGR",
-        "CONSTRUCCIÓN Y OTROS": "CON",
-        "CONSUMO NO ENERGÉTICO": "NEE"
-    }
 
-    # Loss technology
-    # ----------------
-    loss_tech01 = {
-        "Category": "LOS001",
-        "VARIACIÓN DE INVENTARIOS": "INV",
-        "NO APROVECHADO": "WAS",
-    }
+def set_sector_fields(sectors: pd.Series) -> list:
+    """Label sectors (register) of a matrix once.
 
-    loss_tech02 = {
-        "Category": "LOS002",
-        "PÉRDIDAS": "LOS",
-        "CONSUMO PROPIO": "OWN"
-    }
+    Each distinct sector name of the categorical column is
+    labelled a single time and mapped back onto the rows.
 
-    categories = [
-        supply,
-        sec_tech,
-        third_tech,
-        fourth_tech,
-        demand,
-        loss_tech01,
-        loss_tech02
-    ]
-
-    for c in categories:
-        if name in c:
-            return (c["Category"], c[name])
-        else:
-            continue
-    return False
+    """
+    labels = [set_technology_labels(c) for c in sectors.cat.categories]
+    return [labels[code] for code in sectors.cat.codes]
 
 
 if __name__ == "__main__":